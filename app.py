@@ -1,8 +1,21 @@
 import os
+import gzip
+import json
 import logging
-from flask import Flask, render_template, request, jsonify
-from tarot_data import TAROT_DECK
-from openai_service import generate_tarot_reading
+import mimetypes
+import threading
+from flask import (Flask, render_template, request, jsonify, url_for, redirect, Response,
+                   send_from_directory, stream_with_context)
+from card_store import card_store
+from interpretations import interpretation_library
+from openai_service import (Deadline, circuit_breaker_for, generate_tarot_reading,
+                            get_backend, hedger, reading_cache, reading_flight,
+                            routing_policy, stream_tarot_reading, warm_up_backend)
+from reading_jobs import READING_POLL_MAX, JobQueueFull, reading_jobs
+from permalinks import create_permalink, load_permalink, recent_permalinks
+from question_match import question_index
+from reading_store import persistent_cache
+from static_assets import PRECOMPRESSED_EXTENSIONS, asset_fingerprints, precompressed_variant
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -10,14 +23,135 @@ logging.basicConfig(level=logging.DEBUG)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "mystic_tarot_secret_key")
 
+# Fingerprinted static URLs never change content, so they can be cached
+# for a year without revalidation
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# JSON responses at least this large are gzipped on the fly
+JSON_COMPRESS_MIN_BYTES = int(os.environ.get("JSON_COMPRESS_MIN_BYTES", "1024"))
+JSON_COMPRESS_LEVEL = int(os.environ.get("JSON_COMPRESS_LEVEL", "6"))
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    # url_for('static', filename='css/style.css') -> /static/css/style.<hash>.css
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = asset_fingerprints.url_path(values['filename'])
+
+def static_file(filename):
+    filename, immutable = asset_fingerprints.resolve(filename)
+    # Plain or outdated names keep Flask's default revalidating behaviour
+    max_age = STATIC_IMMUTABLE_MAX_AGE if immutable else app.get_send_file_max_age(filename)
+
+    # Serve the prebuilt .br/.gz sibling when the client accepts it
+    precompressed = precompressed_variant(filename, request.accept_encodings)
+    if precompressed:
+        sibling, encoding = precompressed
+        response = send_from_directory(app.static_folder, sibling, max_age=max_age,
+                                       mimetype=mimetypes.guess_type(filename)[0])
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(app.static_folder, filename, max_age=max_age)
+
+    if filename.endswith(PRECOMPRESSED_EXTENSIONS):
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+app.view_functions['static'] = static_file
+
+@app.after_request
+def compress_json(response):
+    # Large JSON payloads (readings echo every card back) are gzipped when the
+    # client accepts it; streamed and already-encoded responses are left alone
+    if (response.mimetype != 'application/json' or response.status_code != 200
+            or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or not request.accept_encodings['gzip']):
+        return response
+    data = response.get_data()
+    if len(data) < JSON_COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=JSON_COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    # The encoded bytes differ from what a strong ETag was computed over
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+# Encode every card's JSON and the deck manifest once per worker, before
+# the first request
+card_store.preload()
+
+# Each gunicorn worker imports this module after forking, so warming up here
+# opens one pooled router connection per worker without blocking boot
+threading.Thread(target=warm_up_backend, daemon=True).start()
+
+# Periodically delete expired rows from the persistent reading cache
+persistent_cache.start_expiry()
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', deck_version=card_store.deck_json()[1])
+
+@app.route('/deck.<version>.json')
+def deck(version):
+    # The whole deck under a content-versioned URL, cached by browsers for
+    # a year; stale versions are redirected to the current one
+    body, current = card_store.deck_json()
+    if version != current:
+        return redirect(url_for('deck', version=current))
+    if request.accept_encodings['gzip']:
+        # Compressed once at startup; compress_json skips encoded responses
+        response = Response(card_store.deck_gzip(), mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+def resolve_selected_cards(selected_cards):
+    # Get card records - selected_cards can be either IDs or card objects,
+    # which are looked up in the store by their "id"
+    cards = []
+    for card_item in selected_cards:
+        card = card_store.resolve(card_item)
+        if card is not None:
+            cards.append(card)
+        else:
+            logging.warning(f"Unknown card item: {card_item!r:.80}")
+    return cards
+
+def reading_request_error(data):
+    # Shape of a reading request body; returns the message for a 400, or None
+    if not isinstance(data, dict):
+        return 'Expected a JSON object'
+    if not isinstance(data.get('question', ''), str):
+        return 'Question must be a string'
+    if not isinstance(data.get('reading_type', '1-card'), str):
+        return 'Invalid reading type'
+    if not isinstance(data.get('selected_cards', []), list):
+        return 'Invalid card selection'
+    return None
+
+def sse_event(data, event=None):
+    # Format a single Server-Sent Events frame with a JSON payload
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 @app.route('/get_reading', methods=['POST'])
 def get_reading():
     try:
-        data = request.get_json()
+        # Start the time budget as soon as the request arrives
+        deadline = Deadline()
+        data = request.get_json(silent=True) or {}
+        error = reading_request_error(data)
+        if error:
+            return jsonify({'error': error}), 400
         question = data.get('question', '')
         selected_cards = data.get('selected_cards', [])
         reading_type = data.get('reading_type', '1-card')
@@ -25,40 +159,191 @@ def get_reading():
         if not selected_cards:
             return jsonify({'error': 'No cards selected'}), 400
         
-        # Get card details - selected_cards can be either IDs or card objects
-        cards_details = []
-        for card_item in selected_cards:
-            if isinstance(card_item, dict):
-                # Card object is already passed
-                cards_details.append(card_item)
-            elif isinstance(card_item, int):
-                # Card ID passed, get from deck
-                if 0 <= card_item < len(TAROT_DECK):
-                    cards_details.append(TAROT_DECK[card_item])
-            else:
-                logging.warning(f"Unexpected card item type: {type(card_item)}")
+        cards = resolve_selected_cards(selected_cards)
         
-        if not cards_details:
+        if not cards:
             return jsonify({'error': 'Invalid card selection'}), 400
         
         # Generate AI reading
-        reading = generate_tarot_reading(question, cards_details, reading_type)
+        reading = generate_tarot_reading(question, cards, reading_type,
+                                         deadline=deadline)
+        token = create_permalink(question, cards, reading_type, reading)
         
         return jsonify({
             'success': True,
             'reading': reading,
-            'cards': cards_details
+            'cards': [card_store.payload(card) for card in cards],
+            'permalink': token,
+            'permalink_url': url_for('permalink', token=token) if token else None
         })
         
     except Exception as e:
         logging.error(f"Error generating reading: {str(e)}")
         return jsonify({'error': 'Failed to generate reading. Please try again.'}), 500
 
+@app.route('/stream_reading', methods=['POST'])
+def stream_reading():
+    deadline = Deadline()
+    data = request.get_json(silent=True) or {}
+    error = reading_request_error(data)
+    if error:
+        return jsonify({'error': error}), 400
+    question = data.get('question', '')
+    selected_cards = data.get('selected_cards', [])
+    reading_type = data.get('reading_type', '1-card')
+
+    if not selected_cards:
+        return jsonify({'error': 'No cards selected'}), 400
+
+    cards = resolve_selected_cards(selected_cards)
+
+    if not cards:
+        return jsonify({'error': 'Invalid card selection'}), 400
+
+    def generate():
+        # Send the cards first so the client can start the reveal animation
+        yield sse_event({'cards': [card_store.payload(card) for card in cards]}, event='cards')
+        parts = []
+        try:
+            for chunk in stream_tarot_reading(question, cards, reading_type,
+                                              deadline=deadline):
+                parts.append(chunk)
+                yield sse_event({'text': chunk})
+        except Exception as e:
+            logging.error(f"Error streaming reading: {str(e)}")
+            yield sse_event({'error': 'Failed to generate reading. Please try again.'}, event='error')
+            return
+        token = create_permalink(question, cards, reading_type, "".join(parts))
+        yield sse_event({'success': True, 'permalink': token}, event='done')
+
+    return Response(stream_with_context(generate()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+@app.route('/readings', methods=['POST'])
+def create_reading_job():
+    data = request.get_json(silent=True) or {}
+    error = reading_request_error(data)
+    if error:
+        return jsonify({'error': error}), 400
+    question = data.get('question', '')
+    selected_cards = data.get('selected_cards', [])
+    reading_type = data.get('reading_type', '1-card')
+
+    if not selected_cards:
+        return jsonify({'error': 'No cards selected'}), 400
+
+    cards = resolve_selected_cards(selected_cards)
+
+    if not cards:
+        return jsonify({'error': 'Invalid card selection'}), 400
+
+    try:
+        job = reading_jobs.submit(question, cards, reading_type)
+    except JobQueueFull:
+        logging.warning("Reading job queue is full")
+        return jsonify({'error': 'The cards are busy right now. Please try again shortly.'}), 503
+
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('get_reading_job', job_id=job.id),
+        'cards': [card_store.payload(card) for card in cards]
+    }), 202
+
+@app.route('/readings/<job_id>')
+def get_reading_job(job_id):
+    # Long-poll: ?wait=N blocks until text past ?since= arrives or the job ends
+    since = max(request.args.get('since', 0, type=int), 0)
+    wait = min(request.args.get('wait', 0, type=float), READING_POLL_MAX)
+    snapshot = reading_jobs.poll(job_id, since, wait)
+    if snapshot is None:
+        return jsonify({'error': 'Reading not found'}), 404
+    return jsonify(snapshot)
+
+@app.route('/r/<token>')
+def permalink(token):
+    # A stored reading never changes, so its permalink response can be
+    # cached by browsers and shared caches indefinitely
+    stored = load_permalink(token)
+    if stored is None:
+        return jsonify({'error': 'Reading not found'}), 404
+
+    cards = [card_store.get(int(card_id)) for card_id in stored.card_ids.split(',')]
+    response = jsonify({
+        'success': True,
+        'question': stored.question,
+        'reading_type': stored.reading_type,
+        'reading': stored.reading,
+        'cards': [card_store.payload(card) for card in cards if card is not None],
+        'permalink': token
+    })
+    response.set_etag(token)
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
 @app.route('/get_card/<int:card_id>')
 def get_card(card_id):
-    if 0 <= card_id < len(TAROT_DECK):
-        return jsonify(TAROT_DECK[card_id])
-    return jsonify({'error': 'Card not found'}), 404
+    card = card_store.get(card_id)
+    if card is None:
+        return jsonify({'error': 'Card not found'}), 404
+
+    # Pre-encoded JSON; revalidation with If-None-Match gets an empty 304
+    body, etag = card_store.serialized(card)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/status')
+def status():
+    # Operational view of the upstream backend and its circuit breaker,
+    # reading caches, request coalescing and background reading jobs
+    return jsonify({
+        'backend': get_backend().stats(),
+        'hedging': hedger.stats(),
+        'routing': routing_policy.stats(),
+        'circuit_breaker': circuit_breaker_for(get_backend()).stats(),
+        'reading_cache': reading_cache.stats(),
+        'persistent_cache': persistent_cache.stats(),
+        'permalinks': recent_permalinks.stats(),
+        'question_matching': question_index.stats(),
+        'interpretations': interpretation_library.stats(),
+        'single_flight': reading_flight.stats(),
+        'reading_jobs': reading_jobs.stats()
+    })
+
+@app.route('/cards', methods=['GET', 'POST'])
+def get_cards():
+    # Batch lookup: GET /cards?ids=1,5,9 or POST /cards {"ids": [1, 5, 9]}
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        ids = data.get('ids', []) if isinstance(data, dict) else None
+        if not isinstance(ids, list):
+            return jsonify({'error': 'Expected a JSON object with an "ids" list'}), 400
+    else:
+        ids = [i for i in request.args.get('ids', '').split(',') if i.strip()]
+
+    try:
+        card_ids = [int(i) for i in ids]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Card ids must be integers'}), 400
+
+    if not card_ids or len(card_ids) > len(card_store):
+        return jsonify({'error': 'Invalid card selection'}), 400
+
+    cards = [card_store.get(i) for i in card_ids]
+    missing = [i for i, card in zip(card_ids, cards) if card is None]
+    if missing:
+        return jsonify({'error': 'Card not found', 'missing': missing}), 404
+
+    # Splice the pre-encoded card JSON instead of re-serializing each card
+    body = b'{"cards":[' + b','.join(card_store.serialized(card)[0] for card in cards) + b']}'
+    return Response(body, mimetype='application/json')
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
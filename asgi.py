@@ -0,0 +1,112 @@
+"""
+ASGI entry point, alongside the WSGI `main:app`.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+POST /get_reading is handled natively on the event loop with the async
+upstream client, so a single process can wait on hundreds of readings at
+once. Every other route is passed to the Flask app through asgiref's
+WSGI adapter, which runs it on a thread pool.
+
+Requires uvicorn (or another ASGI server), asgiref and httpx: the "asgi"
+extra, pip install ".[asgi]".
+"""
+import json
+import asyncio
+import logging
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app as flask_app, reading_request_error, resolve_selected_cards
+from async_service import close_async_client, generate_tarot_reading_async
+from card_store import card_store
+from openai_service import Deadline
+from permalinks import create_permalink
+
+wsgi_application = WsgiToAsgi(flask_app)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_json(send, data, status=200):
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode('ascii'))],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def get_reading(scope, receive, send):
+    # Same contract as app.get_reading
+    deadline = Deadline()
+    try:
+        data = json.loads(await read_body(receive) or b'{}')
+    except ValueError:
+        await send_json(send, {'error': 'Invalid JSON'}, 400)
+        return
+    error = reading_request_error(data)
+    if error:
+        await send_json(send, {'error': error}, 400)
+        return
+    question = data.get('question', '')
+    selected_cards = data.get('selected_cards', [])
+    reading_type = data.get('reading_type', '1-card')
+
+    if not selected_cards:
+        await send_json(send, {'error': 'No cards selected'}, 400)
+        return
+
+    cards = resolve_selected_cards(selected_cards)
+
+    if not cards:
+        await send_json(send, {'error': 'Invalid card selection'}, 400)
+        return
+
+    try:
+        reading = await generate_tarot_reading_async(question, cards, reading_type,
+                                                     deadline=deadline)
+        token = await asyncio.to_thread(create_permalink, question, cards,
+                                        reading_type, reading)
+    except Exception as e:
+        logging.error(f"Error generating reading: {str(e)}")
+        await send_json(send, {'error': 'Failed to generate reading. Please try again.'}, 500)
+        return
+
+    await send_json(send, {
+        'success': True,
+        'reading': reading,
+        'cards': [card_store.payload(card) for card in cards],
+        'permalink': token,
+        'permalink_url': f"/r/{token}" if token else None
+    })
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif (scope['type'] == 'http' and scope['path'] == '/get_reading'
+          and scope['method'] == 'POST'):
+        await get_reading(scope, receive, send)
+    else:
+        await wsgi_application(scope, receive, send)
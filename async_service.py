@@ -0,0 +1,295 @@
+"""
+asyncio counterpart of the reading pipeline in openai_service.py.
+
+The upstream call is made with httpx.AsyncClient, and retries and backoff
+use asyncio.sleep, so one event loop can hold hundreds of readings in
+flight at once. Everything else (circuit breaker, caches, prompts, the
+structured fallback) is shared with the threaded implementation.
+
+Requires httpx (pip install httpx); it is only imported when the first
+async call is made.
+"""
+import os
+import json
+import time
+import asyncio
+import weakref
+
+from card_store import card_store
+from openai_service import (FANOUT_CONCURRENCY, Deadline, _completion_payload, _completion_text,
+                            _log_usage, _message, build_reading_messages, cache_reading,
+                            circuit_breaker_for, fanout_complete, fanout_sections,
+                            generate_structured_reading, get_backend,
+                            get_cached_reading, hedger, library_pieces,
+                            library_synthesis_messages, reading_cache_key, routing_policy,
+                            section_fallback)
+from prompts import (SECTION_TOKEN_BUDGET, SYNTHESIS_TOKEN_BUDGET, build_section_prompt,
+                     build_synthesis_prompt)
+
+# 이벤트 루프 하나가 동시에 열 수 있는 업스트림 연결 수.
+# Upstream connections one event loop may hold open at once.
+HF_ASYNC_MAX_CONNECTIONS = int(os.environ.get("HF_ASYNC_MAX_CONNECTIONS", "200"))
+
+_clients = {}
+# One fan-out limit per event loop, shared by all of its readings
+_fanout_limits = weakref.WeakKeyDictionary()
+
+
+def get_async_client(backend):
+    """
+    이벤트 루프와 백엔드마다 하나의 httpx.AsyncClient를 재사용합니다.
+    Returns the pooled httpx.AsyncClient for `backend` on the running event
+    loop.
+    """
+    import httpx
+
+    key = (asyncio.get_running_loop(), backend.name)
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {backend.token}",
+                "Content-Type": "application/json",
+            },
+            limits=httpx.Limits(max_connections=HF_ASYNC_MAX_CONNECTIONS,
+                                max_keepalive_connections=HF_ASYNC_MAX_CONNECTIONS))
+        _clients[key] = client
+    return client
+
+
+async def close_async_client():
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _clients if key[0] is loop]:
+        await _clients.pop(key).aclose()
+
+
+def get_fanout_limit():
+    """The FANOUT_CONCURRENCY semaphore of the running event loop."""
+    loop = asyncio.get_running_loop()
+    limit = _fanout_limits.get(loop)
+    if limit is None:
+        limit = _fanout_limits[loop] = asyncio.Semaphore(FANOUT_CONCURRENCY)
+    return limit
+
+
+class AsyncSingleFlight:
+    """
+    같은 키의 동시 코루틴 호출은 하나의 업스트림 호출을 공유합니다.
+    Coroutine version of SingleFlight: concurrent awaits with the same key
+    share one task. Callers that time out stop waiting; the task keeps
+    running so its result still reaches the cache.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.shared = 0
+        self._tasks = {}
+
+    async def do(self, key, fn, timeout=None):
+        task = self._tasks.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.shared += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def stats(self):
+        return {
+            "in_flight": len(self._tasks),
+            "leaders": self.leaders,
+            "shared": self.shared,
+        }
+
+
+async_reading_flight = AsyncSingleFlight()
+
+
+async def hf_generate_async(messages, max_tries=6, deadline=None, max_tokens=None,
+                            backend=None):
+    """
+    hf_generate의 asyncio 버전입니다.
+    Async version of hf_generate: same deadline, breaker and retry rules,
+    but waiting never blocks the event loop.
+    """
+    if deadline is None:
+        deadline = Deadline()
+    if backend is None:
+        backend = get_backend()
+
+    if not backend.available():
+        print(f"Error: no API key is configured for the {backend.name} backend.")
+        return None
+
+    breaker = circuit_breaker_for(backend)
+    if not breaker.allow_request():
+        print(f"HF: Circuit breaker for {backend.name} is open; skipping upstream call.")
+        return None
+    if breaker.is_probe():
+        max_tries = 1
+
+    started = time.monotonic()
+    async def complete(b, tries, d):
+        if hasattr(b, "complete_async"):
+            return await b.complete_async(messages, tries, d, max_tokens)
+        return await _hf_request_async(b, messages, tries, d, max_tokens)
+
+    if hedger.enabled_for(backend):
+        text = await hedger.run_async(complete, backend, max_tries, deadline)
+    else:
+        text = await complete(backend, max_tries, deadline)
+    if text:
+        breaker.record_success(time.monotonic() - started)
+    else:
+        breaker.record_failure()
+    return text
+
+
+async def _hf_request_async(backend, messages, max_tries, deadline, max_tokens=None):
+    """Runs the retry loop for a single non-streaming completion."""
+    import httpx
+
+    payload = _completion_payload(backend.model, messages, max_tokens)
+    client = get_async_client(backend)
+
+    backoff_time = 2
+    for i in range(max_tries):
+        if deadline.expired():
+            print("HF: Deadline budget exhausted before the next attempt.")
+            return None
+        try:
+            print(f"Attempting async {backend.name} Chat Completions call (try {i+1})...")
+            r = await client.post(backend.url, json=payload,
+                                  timeout=deadline.timeout(backend.timeout))
+            r.raise_for_status()
+            data = r.json()
+            print("HF Chat Completions API call successful.")
+            _log_usage(messages, data)
+            return _completion_text(data)
+
+        except httpx.HTTPStatusError as e:
+            status_code = e.response.status_code
+            if status_code == 503:
+                # 503: 모델 로딩 중 (Model is loading)
+                try:
+                    eta = e.response.json().get("estimated_time", 6)
+                except Exception:
+                    eta = 6
+                print(f"Model is loading (503). Retrying in {min(eta, 10)} seconds.")
+                if not await deadline.async_sleep(min(eta, 10)):
+                    print("HF: Not enough budget left to wait for the model.")
+                    return None
+                continue
+            print(f"HTTP Error {status_code}: {e.response.text}")
+            return None
+
+        except httpx.HTTPError as e:
+            if i < max_tries - 1:
+                print(f"Connection error: {e!r}. Retrying in {backoff_time} seconds.")
+                if not await deadline.async_sleep(backoff_time):
+                    print("HF: Not enough budget left to retry.")
+                    return None
+                backoff_time *= 1.5
+            else:
+                print(f"Failed to connect to HF API after {max_tries} tries: {e!r}")
+                return None
+
+        except (KeyError, IndexError, TypeError, AttributeError, json.JSONDecodeError) as e:
+            print(f"Error parsing HF response: {e}. Returning None.")
+            print(f"Response text: {r.text}")
+            return None
+
+    print("HF: Model not available or failed to respond after all retries.")
+    return None
+
+
+async def generate_fanout_reading_async(question, sections, deadline, backend):
+    """
+    generate_fanout_reading의 asyncio 버전입니다.
+    Async version of generate_fanout_reading: sections run concurrently,
+    at most FANOUT_CONCURRENCY at a time across all readings on the event
+    loop, like the sync fan-out pool. Returns (text, complete).
+    """
+    limit = get_fanout_limit()
+
+    async def section_text(section):
+        async with limit:
+            return await hf_generate_async(_message(build_section_prompt(question, section)),
+                                           2, deadline, SECTION_TOKEN_BUDGET.output, backend)
+
+    results = await asyncio.gather(*(section_text(section) for section in sections))
+    if not any(results):
+        return None, False
+    parts = [(text or section_fallback(section), bool(text))
+             for text, section in zip(results, sections)]
+    if not deadline.expired():
+        texts = [text for text, _ in parts]
+        synthesis = await hf_generate_async(_message(build_synthesis_prompt(question, texts)),
+                                            1, deadline, SYNTHESIS_TOKEN_BUDGET.output, backend)
+        if synthesis:
+            parts.append((synthesis, True))
+    return "\n\n".join(text for text, _ in parts), fanout_complete(parts, sections)
+
+
+async def generate_library_reading_async(question, pieces, deadline, backend):
+    """Async version of generate_library_reading."""
+    synthesis = await hf_generate_async(library_synthesis_messages(question, pieces), 2,
+                                        deadline, SYNTHESIS_TOKEN_BUDGET.output, backend)
+    if not synthesis:
+        return None
+    return "\n\n".join(pieces + [synthesis])
+
+
+async def generate_tarot_reading_async(question, selected_cards, reading_type,
+                                       deadline=None):
+    """
+    generate_tarot_reading의 asyncio 버전입니다.
+    Async version of generate_tarot_reading. Cache lookups and writes may
+    hit the database, so they run in the default executor.
+    """
+    if deadline is None:
+        deadline = Deadline()
+    selected_cards = card_store.resolve_cards(selected_cards)
+    messages = build_reading_messages(question, selected_cards, reading_type)
+    tier = routing_policy.route(reading_type, messages)
+    backend = tier.backend()
+
+    if backend.available():
+        cache_key = reading_cache_key(question, selected_cards, reading_type)
+        cached = await asyncio.to_thread(get_cached_reading, cache_key, backend.model)
+        if cached is not None:
+            return cached
+
+        pieces = library_pieces(selected_cards, reading_type)
+        sections = fanout_sections(selected_cards, reading_type)
+
+        async def call_upstream():
+            started = time.monotonic()
+            complete = True
+            if pieces:
+                text = await generate_library_reading_async(question, pieces, deadline,
+                                                            backend)
+            elif sections:
+                text, complete = await generate_fanout_reading_async(question, sections,
+                                                                     deadline, backend)
+            else:
+                text = await hf_generate_async(messages,
+                                               deadline=deadline,
+                                               max_tokens=tier.max_tokens_for(reading_type),
+                                               backend=backend)
+            tier.record(time.monotonic() - started, bool(text))
+            if text and len(text) > 50 and complete:
+                await asyncio.to_thread(cache_reading, cache_key, text, backend.model)
+            return text
+
+        text = await async_reading_flight.do(cache_key, call_upstream,
+                                             timeout=deadline.remaining())
+        if text and len(text) > 50:
+            return text
+
+    return generate_structured_reading(question, selected_cards, reading_type)
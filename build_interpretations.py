@@ -0,0 +1,101 @@
+"""
+Offline build of the interpretation library.
+
+    python build_interpretations.py [--backend stub] [--workers 8]
+                                    [--reading-types 3-card,celtic-cross] [--force]
+
+Generates one question-independent interpretation for every card, in
+every position of every spread in SPREAD_POSITIONS, upright and reversed,
+and writes them to INTERPRETATIONS_PATH (data/interpretations.json.gz by
+default). Readings whose spread is fully covered then only ask the model
+for a short synthesis over these pieces.
+
+Entries already in the file are kept unless --force is given, so an
+interrupted build resumes where it stopped; progress is saved every
+SAVE_EVERY entries. `--backend stub` builds a placeholder library without
+network access; it is only used while LLM_BACKEND=stub.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from card_store import card_store
+from interpretations import interpretation_library
+from openai_service import LLM_BACKEND, BACKENDS, Deadline, get_backend, hf_generate
+from prompts import INTERPRETATION_TOKEN_BUDGET, SPREAD_POSITIONS, build_interpretation_prompt
+
+ORIENTATIONS = (False, True)
+SAVE_EVERY = 100
+# Per entry; the build is offline, so it can wait out slow responses
+ENTRY_DEADLINE = 120
+
+
+def missing_entries(reading_types, force=False):
+    """(reading type, position index, position, card, reversed) still to generate."""
+    for reading_type in reading_types:
+        for index, position in enumerate(SPREAD_POSITIONS[reading_type]):
+            for card in card_store:
+                for reversed_ in ORIENTATIONS:
+                    if force or interpretation_library.get(reading_type, index, card,
+                                                           reversed_) is None:
+                        yield reading_type, index, position, card, reversed_
+
+
+def generate_entry(backend, reading_type, position, card, reversed_):
+    prompt = build_interpretation_prompt(reading_type, position, card, reversed_)
+    return hf_generate([{"role": "user", "content": prompt}], 3,
+                       Deadline(ENTRY_DEADLINE), INTERPRETATION_TOKEN_BUDGET.output, backend)
+
+
+def build_library(backend_name=LLM_BACKEND, workers=8, reading_types=None, force=False):
+    backend = get_backend(backend_name)
+    if not backend.available():
+        raise SystemExit(f"The {backend.name} backend has no API key configured.")
+    entries = list(missing_entries(reading_types or list(SPREAD_POSITIONS), force))
+    print(f"{len(entries)} interpretations to generate with {backend.name} ({backend.model})")
+
+    written = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(generate_entry, backend, reading_type, position, card,
+                               reversed_): (reading_type, index, card, reversed_)
+                   for reading_type, index, position, card, reversed_ in entries}
+        for future in as_completed(futures):
+            reading_type, index, card, reversed_ = futures[future]
+            text = future.result()
+            if not text:
+                failed += 1
+                continue
+            interpretation_library.set(reading_type, index, card, reversed_, text)
+            written += 1
+            if written % SAVE_EVERY == 0:
+                interpretation_library.save(backend.model)
+                print(f"{written}/{len(entries)} written")
+
+    if written:
+        interpretation_library.save(backend.model)
+    print(f"Wrote {interpretation_library.path} ({len(interpretation_library)} entries, "
+          f"{failed} failed)")
+
+
+def _csv(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the offline interpretation library.")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=LLM_BACKEND,
+                        help="backend that writes the interpretations")
+    parser.add_argument('--workers', type=int, default=8, help="concurrent completions")
+    parser.add_argument('--reading-types', type=_csv, default=list(SPREAD_POSITIONS),
+                        help="comma-separated reading types to cover")
+    parser.add_argument('--force', action='store_true',
+                        help="regenerate entries that are already in the library")
+
+    args = parser.parse_args(argv)
+    unknown = set(args.reading_types) - set(SPREAD_POSITIONS)
+    if unknown:
+        parser.error(f"unknown reading types: {', '.join(sorted(unknown))}")
+    build_library(args.backend, args.workers, args.reading_types, args.force)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+Offline build steps for static assets.
+
+    python build_static.py images [--widths 120,240,480] [--formats avif,webp,png]
+    python build_static.py compress [--level 9]
+    python build_static.py fingerprint
+
+`images` resizes every card image referenced by TAROT_DECK into several
+widths and formats under static/images/variants/ and writes manifest.json
+next to them, which the app uses to emit srcset for the card faces.
+Requires Pillow (AVIF output needs a Pillow build with AVIF support; the
+format is skipped with a warning otherwise).
+
+`compress` writes .gz (and, if the brotli package is installed, .br)
+siblings next to every static text asset; the static view serves them
+according to Accept-Encoding.
+
+`fingerprint` content-hashes every file under static/ into
+static/asset-manifest.json so workers don't hash assets at boot. Run it
+last, after any step that writes into static/.
+"""
+import os
+import sys
+import gzip
+import json
+import argparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from tarot_data import TAROT_DECK
+from static_assets import (STATIC_DIR, IMAGE_VARIANTS_DIR, IMAGE_MANIFEST_PATH,
+                           ASSET_MANIFEST_PATH, AssetFingerprints,
+                           PRECOMPRESSED_ENCODINGS, PRECOMPRESSED_EXTENSIONS)
+
+DEFAULT_WIDTHS = (120, 240, 480)
+DEFAULT_FORMATS = ('avif', 'webp', 'png')
+# PNG is only the fallback for browsers without AVIF/WebP, so it is kept
+# small: no widths above this, and quantized to a 256-colour palette
+PNG_MAX_WIDTH = 240
+SAVE_OPTIONS = {
+    'avif': {'quality': 55},
+    'webp': {'quality': 80, 'method': 6},
+    'png': {'optimize': True},
+}
+
+
+def _require_pillow():
+    try:
+        from PIL import Image, features
+    except ImportError:
+        sys.exit("build_static.py images requires Pillow: pip install pillow")
+    return Image, features
+
+
+def _is_fresh(target, source):
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+
+def build_images(widths=DEFAULT_WIDTHS, formats=DEFAULT_FORMATS):
+    Image, features = _require_pillow()
+
+    formats = list(formats)
+    for fmt in ('avif', 'webp'):
+        if fmt in formats and not features.check(fmt):
+            print(f"Pillow has no {fmt.upper()} support; skipping {fmt} variants.")
+            formats.remove(fmt)
+
+    out_dir = os.path.join(STATIC_DIR, IMAGE_VARIANTS_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+
+    manifest = {}
+    images = sorted({card['image'] for card in TAROT_DECK})
+    for image in images:
+        source = os.path.join(STATIC_DIR, 'images', image)
+        if not os.path.exists(source):
+            print(f"Missing source image {image}; skipping.")
+            continue
+
+        stem = os.path.splitext(image)[0]
+        with Image.open(source) as original:
+            original.load()
+            entry = {'width': original.width, 'height': original.height, 'variants': {}}
+            # Never upscale; always keep at least one variant
+            targets = [w for w in sorted(widths) if w < original.width] or [original.width]
+
+            for fmt in formats:
+                variants = []
+                fmt_targets = targets
+                if fmt == 'png':
+                    fmt_targets = [w for w in targets if w <= PNG_MAX_WIDTH] or targets[:1]
+                for width in fmt_targets:
+                    height = round(original.height * width / original.width)
+                    name = f"{stem}-{width}.{fmt}"
+                    target = os.path.join(out_dir, name)
+                    if not _is_fresh(target, source):
+                        resized = original.resize((width, height), Image.LANCZOS)
+                        if fmt == 'png':
+                            resized = resized.quantize(256)
+                        elif resized.mode not in ('RGB', 'RGBA'):
+                            resized = resized.convert('RGBA')
+                        resized.save(target, fmt.upper(), **SAVE_OPTIONS[fmt])
+                    variants.append({'width': width, 'path': f"{IMAGE_VARIANTS_DIR}/{name}"})
+                entry['variants'][fmt] = variants
+
+        manifest[image] = entry
+        print(f"{image}: {', '.join(formats)} up to {targets[-1]}px")
+
+    with open(IMAGE_MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    print(f"Wrote {IMAGE_MANIFEST_PATH} ({len(manifest)} images)")
+    return manifest
+
+
+def build_compressed(level=9):
+    compressors = {'gzip': lambda data: gzip.compress(data, compresslevel=level, mtime=0)}
+    if brotli is not None:
+        compressors['br'] = lambda data: brotli.compress(data, quality=11)
+    else:
+        print("brotli is not installed; writing .gz files only.")
+
+    written = 0
+    for root, _, files in os.walk(STATIC_DIR):
+        for name in sorted(files):
+            if not name.endswith(PRECOMPRESSED_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+                target = path + suffix
+                if encoding not in compressors:
+                    continue
+                if _is_fresh(target, path):
+                    continue
+                compressed = compressors[encoding](data)
+                if len(compressed) >= len(data):
+                    continue
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+                print(f"{os.path.relpath(target, STATIC_DIR)}: {len(data)} -> {len(compressed)} bytes")
+    print(f"Wrote {written} compressed files")
+
+
+def build_fingerprints():
+    # Start from an empty manifest so every file is hashed fresh
+    fingerprints = AssetFingerprints(manifest_path=None)
+    for root, _, files in os.walk(STATIC_DIR):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if path == ASSET_MANIFEST_PATH or name.endswith(('.gz', '.br')):
+                continue
+            fingerprints.fingerprint(os.path.relpath(path, STATIC_DIR).replace(os.sep, '/'))
+
+    manifest = fingerprints.manifest()
+    with open(ASSET_MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    print(f"Wrote {ASSET_MANIFEST_PATH} ({len(manifest)} files)")
+    return manifest
+
+
+def _csv(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build static asset variants.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    images = commands.add_parser('images', help="resize card images to WebP/AVIF/PNG variants")
+    images.add_argument('--widths', type=_csv, default=list(map(str, DEFAULT_WIDTHS)),
+                        help="comma-separated target widths in px")
+    images.add_argument('--formats', type=_csv, default=list(DEFAULT_FORMATS),
+                        help="comma-separated output formats (avif, webp, png)")
+
+    compress = commands.add_parser('compress', help="write .gz/.br siblings for static text assets")
+    compress.add_argument('--level', type=int, default=9, help="gzip compression level (1-9)")
+
+    commands.add_parser('fingerprint', help="content-hash static files into asset-manifest.json")
+
+    args = parser.parse_args(argv)
+    if args.command == 'images':
+        build_images(widths=[int(w) for w in args.widths], formats=args.formats)
+    elif args.command == 'compress':
+        build_compressed(level=args.level)
+    elif args.command == 'fingerprint':
+        build_fingerprints()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import gzip
+import json
+import hashlib
+import threading
+from types import MappingProxyType
+from typing import NamedTuple
+
+from tarot_data import TAROT_DECK
+from static_assets import build_image_sources
+
+
+class Card(NamedTuple):
+    """Immutable record for one tarot card."""
+
+    id: int
+    name: str
+    element: str
+    suit: str
+    keywords: tuple
+    upright: tuple
+    reversed: tuple
+    description: str
+    image: str
+
+    @classmethod
+    def from_dict(cls, data):
+        image = data['image']
+        return cls(id=data['id'],
+                   name=data['name'],
+                   element=data['element'],
+                   suit=suit_from_image(image),
+                   keywords=tuple(data['keywords']),
+                   upright=tuple(data['meanings']['upright']),
+                   reversed=tuple(data['meanings']['reversed']),
+                   description=data['description'],
+                   image=image)
+
+    def to_dict(self):
+        # Same shape as the TAROT_DECK entries; a fresh dict on every call
+        return {
+            'id': self.id,
+            'name': self.name,
+            'element': self.element,
+            'keywords': list(self.keywords),
+            'meanings': {
+                'upright': list(self.upright),
+                'reversed': list(self.reversed)
+            },
+            'description': self.description,
+            'image': self.image
+        }
+
+
+def suit_from_image(image):
+    # major_arcana_fool.png -> "major"; minor_arcana_cups_ace.png -> "cups"
+    parts = image.split('_')
+    return 'major' if parts[0] == 'major' else parts[2]
+
+
+def _freeze_index(index):
+    return MappingProxyType({key: tuple(cards) for key, cards in index.items()})
+
+
+class CardStore:
+    """
+    The deck as frozen Card records with constant-time lookups by id, name,
+    image, suit, element and keyword. Built once at import; nothing in it
+    can be mutated by request handlers.
+    """
+
+    def __init__(self, deck):
+        self.cards = tuple(Card.from_dict(data) for data in deck)
+        self._by_id = MappingProxyType({card.id: card for card in self.cards})
+        self._by_name = MappingProxyType({card.name.lower(): card for card in self.cards})
+        self._by_image = MappingProxyType({card.image: card for card in self.cards})
+
+        by_suit, by_element, by_keyword = {}, {}, {}
+        for card in self.cards:
+            by_suit.setdefault(card.suit, []).append(card)
+            by_element.setdefault(card.element.lower(), []).append(card)
+            for keyword in card.keywords:
+                by_keyword.setdefault(keyword.lower(), []).append(card)
+        self._by_suit = _freeze_index(by_suit)
+        self._by_element = _freeze_index(by_element)
+        self._by_keyword = _freeze_index(by_keyword)
+
+        self._images = None
+        self._serialized = None
+        self._deck_json = None
+        self._deck_gzip = None
+        self._images_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __iter__(self):
+        return iter(self.cards)
+
+    def get(self, card_id):
+        return self._by_id.get(card_id)
+
+    def by_name(self, name):
+        return self._by_name.get(name.lower())
+
+    def by_image(self, image):
+        return self._by_image.get(image)
+
+    def by_suit(self, suit):
+        return self._by_suit.get(suit.lower(), ())
+
+    def by_element(self, element):
+        return self._by_element.get(element.lower(), ())
+
+    def by_keyword(self, keyword):
+        return self._by_keyword.get(keyword.lower(), ())
+
+    def resolve(self, item):
+        """
+        Maps a card reference (Card, id, or a card dict with an "id") to
+        its Card record, or None if it isn't in the deck.
+        """
+        if isinstance(item, Card):
+            return item
+        if isinstance(item, dict):
+            item = item.get('id')
+        if isinstance(item, int) and not isinstance(item, bool):
+            return self._by_id.get(item)
+        return None
+
+    def resolve_cards(self, items):
+        return [card for card in map(self.resolve, items) if card is not None]
+
+    def image_sources(self, card):
+        # Resolved lazily: the first call hashes the image files (see
+        # static_assets), which callers that never build payloads skip
+        if self._images is None:
+            with self._images_lock:
+                if self._images is None:
+                    self._images = build_image_sources(c.image for c in self.cards)
+        return self._images.get(card.image)
+
+    def payload(self, card):
+        """Card data as sent to the browser, with its resized image variants."""
+        return dict(card.to_dict(), images=self.image_sources(card))
+
+    def serialized(self, card):
+        """
+        The card's payload as UTF-8 JSON bytes plus a strong ETag, encoded
+        once for the whole deck and then served straight from memory.
+        """
+        if self._serialized is None:
+            # Concurrent first calls may both encode; the results are identical
+            serialized = {}
+            for c in self.cards:
+                body = json.dumps(self.payload(c), separators=(',', ':'),
+                                  sort_keys=True).encode('utf-8')
+                serialized[c.id] = (body, hashlib.blake2b(body, digest_size=12).hexdigest())
+            self._serialized = MappingProxyType(serialized)
+        return self._serialized[card.id]
+
+    def deck_json(self):
+        """
+        The whole deck as one JSON document ({"cards": [...]} in id order)
+        and a content version used to build its long-lived URL. A gzipped
+        copy of the body is encoded at the same time (see deck_gzip()).
+        """
+        if self._deck_json is None:
+            body = b'{"cards":[' + b','.join(self.serialized(c)[0] for c in self.cards) + b']}'
+            self._deck_gzip = gzip.compress(body, compresslevel=9, mtime=0)
+            self._deck_json = (body, hashlib.blake2b(body, digest_size=6).hexdigest())
+        return self._deck_json
+
+    def deck_gzip(self):
+        """deck_json()'s body, gzipped once rather than on every request."""
+        self.deck_json()
+        return self._deck_gzip
+
+    def preload(self):
+        """Resolves image sources and encodes the cards and deck JSON up front."""
+        self.deck_json()
+
+
+card_store = CardStore(TAROT_DECK)
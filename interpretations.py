@@ -0,0 +1,131 @@
+import os
+import gzip
+import json
+import logging
+import threading
+
+from prompts import SPREAD_POSITIONS
+
+# Written by `python build_interpretations.py`; without it every reading
+# goes to the model in full
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+INTERPRETATIONS_PATH = os.environ.get("INTERPRETATIONS_PATH",
+                                      os.path.join(DATA_DIR, 'interpretations.json.gz'))
+LIBRARY_VERSION = 1
+# A library written by the offline stub is placeholder text; it is only
+# served when readings come from the stub as well. Same setting and default
+# as openai_service.LLM_BACKEND, read here to avoid a circular import.
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "hf")
+STUB_MODEL = "stub"
+
+
+def entry_key(reading_type, position_index, card_id, reversed_=False):
+    """e.g. "celtic-cross:1:16:u" for an upright Tower as the challenge."""
+    return f"{reading_type}:{position_index}:{card_id}:{'r' if reversed_ else 'u'}"
+
+
+class InterpretationLibrary:
+    """
+    Question-independent interpretations of every card in every spread
+    position and orientation, generated offline and stored as gzipped
+    JSON. The file is read on first use; a missing or unreadable file, or
+    a stub-built one outside stub mode, leaves the library empty.
+    """
+
+    def __init__(self, path=INTERPRETATIONS_PATH):
+        self.path = path
+        self.model = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read interpretation library {self.path}: {e}")
+            return {}
+        if data.get('version') != LIBRARY_VERSION:
+            logging.warning(f"Ignoring interpretation library {self.path} "
+                            f"with version {data.get('version')}")
+            return {}
+        if data.get('model') == STUB_MODEL and LLM_BACKEND != STUB_MODEL:
+            logging.warning(f"Ignoring interpretation library {self.path}: it was built "
+                            f"with the stub backend, but LLM_BACKEND is {LLM_BACKEND!r}. "
+                            f"Rebuild it with python build_interpretations.py.")
+            return {}
+        self.model = data.get('model')
+        return data.get('entries', {})
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            with self._lock:
+                if self._entries is None:
+                    self._entries = self._load()
+        return self._entries
+
+    def get(self, reading_type, position_index, card, reversed_=False):
+        return self.entries.get(entry_key(reading_type, position_index, card.id, reversed_))
+
+    def set(self, reading_type, position_index, card, reversed_, text):
+        entries = self.entries
+        with self._lock:
+            entries[entry_key(reading_type, position_index, card.id, reversed_)] = text
+
+    def pieces(self, selected_cards, reading_type, orientations=None):
+        """
+        Returns [(position, card, text), ...] in spread order, or None unless
+        the library covers every card of the spread.
+        """
+        positions = SPREAD_POSITIONS.get(reading_type)
+        if not positions or len(selected_cards) != len(positions):
+            return None
+        if orientations is None:
+            orientations = [False] * len(selected_cards)
+        pieces = []
+        for index, (position, card, reversed_) in enumerate(
+                zip(positions, selected_cards, orientations)):
+            text = self.get(reading_type, index, card, reversed_)
+            if text is None:
+                self.misses += 1
+                return None
+            pieces.append((position, card, text))
+        self.hits += 1
+        return pieces
+
+    def save(self, model=None):
+        """Writes the library atomically, so readers never see a partial file."""
+        if model is not None:
+            self.model = model
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        entries = self.entries
+        with self._lock:
+            data = {'version': LIBRARY_VERSION, 'model': self.model,
+                    'entries': dict(sorted(entries.items()))}
+        tmp_path = f"{self.path}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=9) as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'model': self.model,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+interpretation_library = InterpretationLibrary()
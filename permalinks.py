@@ -0,0 +1,109 @@
+import os
+import hmac
+import base64
+import hashlib
+from typing import NamedTuple
+
+from card_store import card_store
+from openai_service import ReadingCache
+from question_match import normalize_question
+from reading_store import READING_ARCHIVE_REUSE_TTL, key_digest, reading_archive
+
+# Tokens are signed so ids can't be enumerated or spreads forged
+PERMALINK_SECRET = (os.environ.get("PERMALINK_SECRET")
+                    or os.environ.get("SESSION_SECRET", "mystic_tarot_secret_key"))
+PERMALINK_VERSION = 1
+SIGNATURE_BYTES = 8
+# Position in this tuple is the reading type's code in the token
+READING_TYPES = ("1-card", "3-card", "celtic-cross")
+MAX_CARDS = 16
+# Tokens of recently archived readings, so a repeat (e.g. a cache hit) gets
+# the same permalink without touching the database
+PERMALINK_CACHE_SIZE = int(os.environ.get("PERMALINK_CACHE_SIZE", "1024"))
+
+recent_permalinks = ReadingCache(maxsize=PERMALINK_CACHE_SIZE, ttl=READING_ARCHIVE_REUSE_TTL)
+
+
+class Permalink(NamedTuple):
+    reading_id: int
+    card_ids: tuple
+    reading_type: str
+    orientations: int
+
+
+def _sign(body):
+    return hmac.new(PERMALINK_SECRET.encode('utf-8'), body,
+                    hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+
+def encode_permalink(reading_id, card_ids, reading_type, orientations=0):
+    """
+    Packs a reading id and its spread into a short URL-safe token:
+    version, reading type, card count, one byte per card id, the
+    orientation bits, the reading id, then a truncated HMAC.
+    """
+    card_ids = tuple(card_ids)
+    mask_bytes = (len(card_ids) + 7) // 8
+    body = bytes((PERMALINK_VERSION, READING_TYPES.index(reading_type), len(card_ids)))
+    body += bytes(card_ids)
+    body += orientations.to_bytes(mask_bytes, 'big')
+    body += reading_id.to_bytes(max(1, (reading_id.bit_length() + 7) // 8), 'big')
+    return base64.urlsafe_b64encode(body + _sign(body)).rstrip(b'=').decode('ascii')
+
+
+def decode_permalink(token):
+    """Returns the token's Permalink, or None if it is malformed or forged."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (ValueError, TypeError):
+        return None
+    body, signature = raw[:-SIGNATURE_BYTES], raw[-SIGNATURE_BYTES:]
+    if len(body) < 4 or not hmac.compare_digest(signature, _sign(body)):
+        return None
+
+    version, type_code, count = body[0], body[1], body[2]
+    mask_bytes = (count + 7) // 8
+    id_start = 3 + count + mask_bytes
+    if (version != PERMALINK_VERSION or type_code >= len(READING_TYPES)
+            or count > MAX_CARDS or len(body) <= id_start):
+        return None
+    return Permalink(reading_id=int.from_bytes(body[id_start:], 'big'),
+                     card_ids=tuple(body[3:3 + count]),
+                     reading_type=READING_TYPES[type_code],
+                     orientations=int.from_bytes(body[3 + count:id_start], 'big'))
+
+
+def create_permalink(question, cards, reading_type, reading, orientations=0):
+    """
+    Stores a finished reading and returns its permalink token, or None if
+    the spread can't be encoded or the database write failed. The same
+    reading for the same cache key reuses one stored row.
+    """
+    card_ids = [card.id for card in card_store.resolve_cards(cards)]
+    if reading_type not in READING_TYPES or not card_ids or len(card_ids) > MAX_CARDS:
+        return None
+    digest = key_digest((normalize_question(question), card_ids, reading_type,
+                         orientations, reading))
+    token = recent_permalinks.get(digest)
+    if token is not None:
+        return token
+    reading_id = reading_archive.save(question, card_ids, reading_type, reading,
+                                      orientations, digest)
+    if reading_id is None:
+        return None
+    token = encode_permalink(reading_id, card_ids, reading_type, orientations)
+    recent_permalinks.set(digest, token)
+    return token
+
+
+def load_permalink(token):
+    """Returns the StoredReading a token points at, or None."""
+    permalink = decode_permalink(token)
+    if permalink is None:
+        return None
+    stored = reading_archive.load(permalink.reading_id)
+    if (stored is None or stored.reading_type != permalink.reading_type
+            or stored.card_ids != ','.join(map(str, permalink.card_ids))
+            or stored.orientations != permalink.orientations):
+        return None
+    return stored
@@ -0,0 +1,197 @@
+"""
+Question normalization and near-duplicate matching for the reading cache.
+
+normalize_question() gives the canonical form used in cache keys: lower
+case, punctuation and filler words (articles, "I"/"my", prepositions)
+dropped, so "Will I get the job?" and "will i get this job??" share a key
+in every worker and in the persistent cache. Object pronouns such as "me"
+are kept: "Will he leave me?" is not "Will he leave?".
+
+QuestionIndex catches what normalization can't (typos and plurals): it
+remembers the questions of recently generated readings per spread and
+finds one close enough to a new question for the same cards and reading
+type. Every word of each question has to pair up with a word of the
+other, either exactly, as a plural ("s"/"es") or by character trigram
+shingles (typos); a question with a word left over (another name, place
+or time) never matches, and neither does a word that only extends the
+other one ("Paul"/"Paula", "win"/"wine"). The score is the mean similarity of the pairs,
+and it must be above QUESTION_MATCH_THRESHOLD. Questions that differ in
+negation never match.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Mean word similarity a question must exceed to reuse another's reading
+QUESTION_MATCH_THRESHOLD = float(os.environ.get("QUESTION_MATCH_THRESHOLD", "0.8"))
+# Questions remembered per spread, and spreads remembered per worker (LRU)
+QUESTION_MATCH_PER_SPREAD = int(os.environ.get("QUESTION_MATCH_PER_SPREAD", "16"))
+QUESTION_MATCH_SPREADS = int(os.environ.get("QUESTION_MATCH_SPREADS", "4096"))
+# Shingle overlap at which two words count as the same word (typos)
+WORD_MATCH_THRESHOLD = 0.5
+# Endings that take "es" rather than "s" in the plural: match/matches
+ES_PLURAL_ENDINGS = ("s", "x", "z", "ch", "sh")
+
+STOPWORDS = frozenset((
+    "a", "an", "the", "this", "that", "these", "those", "i", "im", "my", "our",
+    "please", "just", "really", "actually", "ever", "so", "some", "any",
+    "to", "for", "of", "in", "on", "at", "about", "with", "tarot", "card", "cards",
+    "reading",
+))
+NEGATIONS = frozenset((
+    "not", "no", "never", "dont", "doesnt", "didnt", "isnt", "arent", "wasnt", "werent",
+    "wont", "cant", "cannot", "shouldnt", "wouldnt", "couldnt", "havent", "hasnt",
+))
+
+_APOSTROPHES = re.compile(r"['’]")
+_WORDS = re.compile(r"\w+")
+
+
+def question_tokens(question):
+    """Lower-cased words without punctuation or stopwords, in order."""
+    words = _WORDS.findall(_APOSTROPHES.sub("", (question or "").lower()))
+    # A question made only of stopwords keeps them rather than becoming ""
+    return [word for word in words if word not in STOPWORDS] or words
+
+
+def normalize_question(question):
+    """Canonical form of a question for cache keys."""
+    return " ".join(question_tokens(question))
+
+
+def word_shingles(word):
+    padded = f" {word} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def is_plural_of(long, short):
+    if len(short) < 3:
+        return False
+    suffix = long[len(short):]
+    return suffix == "s" or (suffix == "es" and short.endswith(ES_PLURAL_ENDINGS))
+
+
+def word_similarity(a, b):
+    """
+    1.0 for the same word (or its plural), else the shingle Jaccard index,
+    or 0.0 when that is below WORD_MATCH_THRESHOLD.
+    """
+    word_a, shingles_a = a
+    word_b, shingles_b = b
+    if word_a == word_b:
+        return 1.0
+    short, long = sorted((word_a, word_b), key=len)
+    if long.startswith(short):
+        # Plurals (job/jobs, match/matches) are the same word; any other
+        # extension is another one (Chris/Christa, Ann/Anne, fine/fined)
+        return 1.0 if is_plural_of(long, short) else 0.0
+    score = len(shingles_a & shingles_b) / len(shingles_a | shingles_b)
+    return score if score >= WORD_MATCH_THRESHOLD else 0.0
+
+
+class QuestionSignature:
+    __slots__ = ("words", "negations")
+
+    def __init__(self, normalized):
+        tokens = normalized.split()
+        self.words = [(word, word_shingles(word)) for word in tokens]
+        self.negations = NEGATIONS.intersection(tokens)
+
+    def similarity(self, other):
+        """
+        Mean similarity of the paired words, or 0.0 unless every word on
+        both sides pairs up.
+        """
+        if (not self.words or len(self.words) != len(other.words)
+                or self.negations != other.negations):
+            return 0.0
+        unmatched = list(other.words)
+        total = 0.0
+        for word in self.words:
+            scores = [word_similarity(word, candidate) for candidate in unmatched]
+            best = max(range(len(scores)), key=scores.__getitem__)
+            if not scores[best]:
+                return 0.0
+            total += scores[best]
+            del unmatched[best]
+        return total / len(self.words)
+
+
+class QuestionIndex:
+    """
+    Recently generated questions per spread, for near-duplicate lookups.
+    Keys are reading cache keys: (normalized question, card ids, reading
+    type). Only keys whose reading was generated are added, so a match
+    always points at an original reading rather than at another match.
+    """
+
+    def __init__(self, threshold=QUESTION_MATCH_THRESHOLD,
+                 per_spread=QUESTION_MATCH_PER_SPREAD, max_spreads=QUESTION_MATCH_SPREADS):
+        self.threshold = threshold
+        self.per_spread = per_spread
+        self.max_spreads = max_spreads
+        self.lookups = 0
+        self.matches = 0
+        self.hits = 0
+        self._spreads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, cache_key):
+        question, spread = cache_key[0], cache_key[1:]
+        if not question or self.threshold >= 1:
+            return
+        signature = QuestionSignature(question)
+        with self._lock:
+            questions = self._spreads.get(spread)
+            if questions is None:
+                questions = self._spreads[spread] = OrderedDict()
+            self._spreads.move_to_end(spread)
+            questions[question] = signature
+            questions.move_to_end(question)
+            while len(questions) > self.per_spread:
+                questions.popitem(last=False)
+            while len(self._spreads) > self.max_spreads:
+                self._spreads.popitem(last=False)
+
+    def match(self, cache_key):
+        """The cache key of the most similar question for the same spread, or None."""
+        question, spread = cache_key[0], cache_key[1:]
+        if not question or self.threshold >= 1:
+            return None
+        with self._lock:
+            self.lookups += 1
+            candidates = list(self._spreads.get(spread, {}).items())
+        signature = QuestionSignature(question)
+        best, best_score = None, self.threshold
+        for candidate, candidate_signature in candidates:
+            if candidate == question:
+                continue
+            score = signature.similarity(candidate_signature)
+            if score > best_score:
+                best, best_score = candidate, score
+        if best is None:
+            return None
+        with self._lock:
+            self.matches += 1
+        return (best,) + spread
+
+    def record_hit(self):
+        """Counts a match whose reading was still cached."""
+        with self._lock:
+            self.hits += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "spreads": len(self._spreads),
+                "questions": sum(len(questions) for questions in self._spreads.values()),
+                "lookups": self.lookups,
+                "matches": self.matches,
+                "hits": self.hits,
+                "hit_ratio": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            }
+
+
+question_index = QuestionIndex()
@@ -0,0 +1,246 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from card_store import card_store
+from openai_service import Deadline, reading_cache_key, stream_tarot_reading
+from permalinks import create_permalink
+from reading_store import job_store
+
+# Number of readings generated concurrently, and how many jobs (queued or
+# running) a worker will hold before rejecting new ones
+READING_WORKERS = int(os.environ.get("READING_WORKERS", "4"))
+READING_QUEUE_LIMIT = int(os.environ.get("READING_QUEUE_LIMIT", "64"))
+# How long finished jobs stay fetchable, and the longest a poll may block
+READING_JOB_TTL = float(os.environ.get("READING_JOB_TTL", "600"))
+READING_POLL_MAX = float(os.environ.get("READING_POLL_MAX", "20"))
+# How often a running job's text is copied to the shared job store, and how
+# often a poll for a job running elsewhere re-reads it
+READING_JOB_PUBLISH_INTERVAL = float(os.environ.get("READING_JOB_PUBLISH_INTERVAL", "0.5"))
+READING_JOB_POLL_INTERVAL = 0.25
+# Stale rows are deleted from the job store at most this often
+READING_JOB_EXPIRE_INTERVAL = 60
+
+
+class JobQueueFull(Exception):
+    """Raised when the worker already holds READING_QUEUE_LIMIT active jobs."""
+
+
+def job_snapshot(job_id, status, text, since, cards, error=None, permalink=None):
+    """The poll response for a job, local or read from the job store."""
+    done = status in (ReadingJob.DONE, ReadingJob.ERROR)
+    data = {
+        'job_id': job_id,
+        'status': status,
+        'text': text[since:],
+        'offset': len(text),
+        'done': done,
+    }
+    if status == ReadingJob.DONE:
+        data['reading'] = text
+        data['cards'] = [card_store.payload(card) for card in cards]
+        data['permalink'] = permalink
+    if error:
+        data['error'] = error
+    return data
+
+
+class ReadingJob:
+    """
+    A reading being generated in the background. The text grows as chunks
+    arrive so pollers can render it progressively.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    ERROR = "error"
+
+    def __init__(self, key, question, cards, reading_type):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.question = question
+        self.cards = cards
+        self.reading_type = reading_type
+        self.status = self.QUEUED
+        self.text = ""
+        self.error = None
+        self.permalink = None
+        self.created_at = time.monotonic()
+        self.finished_at = None
+        self.changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.ERROR)
+
+    def append(self, chunk):
+        with self.changed:
+            self.status = self.RUNNING
+            self.text += chunk
+            self.changed.notify_all()
+
+    def finish(self, status, error=None):
+        with self.changed:
+            self.status = status
+            self.error = error
+            self.finished_at = time.monotonic()
+            self.changed.notify_all()
+
+    def wait(self, since, timeout):
+        """
+        Blocks until there is text past offset `since`, the job finishes,
+        or `timeout` seconds pass.
+        """
+        with self.changed:
+            self.changed.wait_for(
+                lambda: self.finished or len(self.text) > since, timeout)
+
+    def snapshot(self, since=0):
+        with self.changed:
+            return job_snapshot(self.id, self.status, self.text, since, self.cards,
+                                self.error, self.permalink)
+
+    def publish(self, store):
+        """Copies the job's current state to the shared job store."""
+        with self.changed:
+            state = (self.id, self.status, [card.id for card in self.cards], self.text,
+                     self.error, self.permalink)
+        store.save(*state)
+
+
+class ReadingJobQueue:
+    """
+    Runs readings on a bounded thread pool and keeps their state in memory.
+
+    Jobs run in the process that accepted them, which also publishes their
+    progress to the shared job store every READING_JOB_PUBLISH_INTERVAL, so
+    a poll that reaches another gunicorn worker (or, with DATABASE_URL set,
+    another instance) is answered from there. Identical requests submitted
+    to a worker while a job is still active get that job's id back instead
+    of a new upstream call.
+    """
+
+    def __init__(self, workers=READING_WORKERS, limit=READING_QUEUE_LIMIT,
+                 ttl=READING_JOB_TTL, store=job_store):
+        self.limit = limit
+        self.ttl = ttl
+        self.store = store
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self._jobs = {}
+        self._active = {}
+        self._store_expired_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="reading")
+
+    def submit(self, question, cards, reading_type):
+        key = reading_cache_key(question, cards, reading_type)
+        with self._lock:
+            self._expire()
+            job = self._active.get(key)
+            if job is not None:
+                self.coalesced += 1
+                return job
+            if len(self._active) >= self.limit:
+                self.rejected += 1
+                raise JobQueueFull()
+            job = ReadingJob(key, question, cards, reading_type)
+            self._jobs[job.id] = job
+            self._active[key] = job
+            self.submitted += 1
+            expire_store = (time.monotonic() - self._store_expired_at
+                            > READING_JOB_EXPIRE_INTERVAL)
+            if expire_store:
+                self._store_expired_at = time.monotonic()
+        if expire_store:
+            self.store.expire(self.ttl)
+        job.publish(self.store)
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def poll(self, job_id, since=0, wait=0):
+        """
+        Returns the job's snapshot past offset `since`, waiting up to `wait`
+        seconds for new text, or None if no worker knows the job.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            if wait > 0:
+                job.wait(since, wait)
+            return job.snapshot(since)
+
+        # Submitted to another worker: re-read the job store until it moves
+        give_up_at = time.monotonic() + wait
+        while True:
+            record = self.store.load(job_id)
+            if record is None:
+                return None
+            remaining = give_up_at - time.monotonic()
+            if (record.status in (ReadingJob.DONE, ReadingJob.ERROR)
+                    or len(record.text) > since or remaining <= 0):
+                cards = card_store.resolve_cards(
+                    [int(card_id) for card_id in record.card_ids.split(',')])
+                return job_snapshot(record.id, record.status, record.text, since, cards,
+                                    record.error, record.permalink)
+            time.sleep(min(READING_JOB_POLL_INTERVAL, remaining))
+
+    def _run(self, job):
+        # The time budget starts when a worker picks the job up, not while
+        # it waits in the queue
+        deadline = Deadline()
+        published_at = time.monotonic()
+        try:
+            for chunk in stream_tarot_reading(job.question, job.cards,
+                                              job.reading_type,
+                                              deadline=deadline):
+                job.append(chunk)
+                if time.monotonic() - published_at >= READING_JOB_PUBLISH_INTERVAL:
+                    job.publish(self.store)
+                    published_at = time.monotonic()
+            job.permalink = create_permalink(job.question, job.cards,
+                                             job.reading_type, job.text)
+            job.finish(ReadingJob.DONE)
+        except Exception as e:
+            logging.error(f"Error generating reading for job {job.id}: {str(e)}")
+            job.finish(ReadingJob.ERROR,
+                       'Failed to generate reading. Please try again.')
+        finally:
+            job.publish(self.store)
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+
+    def _expire(self):
+        # Called with the lock held; drops finished jobs past their TTL
+        now = time.monotonic()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': len(self._active),
+                'stored': len(self._jobs),
+                'limit': self.limit,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'store_errors': self.store.errors,
+            }
+
+
+reading_jobs = ReadingJobQueue()
@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from sqlalchemy import (Float, Index, Integer, String, Text, create_engine, delete, event,
+                        select)
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
+
+# Local SQLite file unless DATABASE_URL points at PostgreSQL (or any other
+# SQLAlchemy URL)
+INSTANCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+DEFAULT_DATABASE_URL = 'sqlite:///' + os.path.join(INSTANCE_DIR, 'readings.db')
+DATABASE_URL = os.environ.get("DATABASE_URL") or DEFAULT_DATABASE_URL
+# Persistent readings outlive deploys, so they are kept much longer than
+# the in-memory cache; expired rows are deleted every interval
+READING_DB_TTL = float(os.environ.get("READING_DB_TTL", str(7 * 24 * 3600)))
+READING_DB_EXPIRE_INTERVAL = float(os.environ.get("READING_DB_EXPIRE_INTERVAL", "600"))
+# Permalinked readings are deleted this long after they were stored (0
+# keeps them forever). A repeat of the same reading within the reuse window
+# gets the existing row instead of a new one.
+READING_ARCHIVE_TTL = float(os.environ.get("READING_ARCHIVE_TTL", str(90 * 24 * 3600)))
+READING_ARCHIVE_REUSE_TTL = float(os.environ.get("READING_ARCHIVE_REUSE_TTL", "86400"))
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class CachedReading(Base):
+    """One generated reading, keyed by a hash of what produced it."""
+
+    __tablename__ = 'reading_cache'
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    reading: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[float] = mapped_column(Float)
+    expires_at: Mapped[float] = mapped_column(Float)
+
+    __table_args__ = (Index('ix_reading_cache_expires_at', 'expires_at'),)
+
+
+class StoredReading(Base):
+    """A reading kept for its permalink, for READING_ARCHIVE_TTL."""
+
+    __tablename__ = 'stored_reading'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    question: Mapped[str] = mapped_column(Text)
+    reading_type: Mapped[str] = mapped_column(String(32))
+    # Comma-separated card ids in spread order
+    card_ids: Mapped[str] = mapped_column(String(64))
+    # Bit i set = card i is reversed
+    orientations: Mapped[int] = mapped_column(Integer, default=0)
+    reading: Mapped[str] = mapped_column(Text)
+    # key_digest() of the cache key, orientations and text, to reuse rows
+    digest: Mapped[str] = mapped_column(String(64), nullable=True)
+    created_at: Mapped[float] = mapped_column(Float)
+
+    __table_args__ = (Index('ix_stored_reading_digest', 'digest'),
+                      Index('ix_stored_reading_created_at', 'created_at'))
+
+
+class ReadingJobRecord(Base):
+    """
+    Progress of a background reading, published by the process running it
+    so a poll that reaches another worker or instance can still answer.
+    """
+
+    __tablename__ = 'reading_job'
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    status: Mapped[str] = mapped_column(String(16))
+    # Comma-separated card ids in spread order
+    card_ids: Mapped[str] = mapped_column(String(64))
+    text: Mapped[str] = mapped_column(Text, default='')
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    permalink: Mapped[str] = mapped_column(String(64), nullable=True)
+    updated_at: Mapped[float] = mapped_column(Float)
+
+    __table_args__ = (Index('ix_reading_job_updated_at', 'updated_at'),)
+
+
+def database_url(url):
+    # Heroku/Replit style postgres:// URLs are not accepted by SQLAlchemy 2,
+    # and plain postgresql:// may pick a driver other than the installed
+    # psycopg2
+    for scheme in ('postgres://', 'postgresql://'):
+        if url.startswith(scheme):
+            return 'postgresql+psycopg2://' + url[len(scheme):]
+    return url
+
+
+def key_digest(key):
+    """Hashes a cache key tuple (question, card ids, reading type, model)."""
+    encoded = json.dumps(key, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def create_db_engine(url=DATABASE_URL):
+    url = database_url(url)
+    if url.startswith('sqlite'):
+        if url == DEFAULT_DATABASE_URL:
+            os.makedirs(INSTANCE_DIR, exist_ok=True)
+        engine = create_engine(url, connect_args={'check_same_thread': False,
+                                                  'timeout': 5})
+
+        @event.listens_for(engine, 'connect')
+        def _sqlite_pragmas(connection, _):
+            # WAL lets gunicorn workers read while another one writes
+            cursor = connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.close()
+
+        return engine
+    connect_args = {'connect_timeout': 3} if url.startswith('postgresql') else {}
+    return create_engine(url, pool_pre_ping=True, pool_recycle=300,
+                         connect_args=connect_args)
+
+
+_session_factories = {}
+_session_lock = threading.Lock()
+
+
+def session_factory(url=DATABASE_URL):
+    """
+    Returns a sessionmaker for `url`, connecting and creating the tables on
+    first use rather than at import.
+    """
+    factory = _session_factories.get(url)
+    if factory is None:
+        with _session_lock:
+            factory = _session_factories.get(url)
+            if factory is None:
+                engine = create_db_engine(url)
+                Base.metadata.create_all(engine)
+                factory = sessionmaker(engine, expire_on_commit=False)
+                _session_factories[url] = factory
+    return factory
+
+
+class PersistentReadingCache:
+    """
+    Reading cache stored in a database table, shared by every worker and
+    instance and kept across restarts. Database errors are logged and
+    treated as misses so a broken database never fails a reading.
+    """
+
+    def __init__(self, url=DATABASE_URL, ttl=READING_DB_TTL):
+        self.url = url
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._expiry_thread = None
+
+    def get(self, key):
+        digest = key_digest(key)
+        try:
+            with session_factory(self.url)() as session:
+                row = session.get(CachedReading, digest)
+        except SQLAlchemyError as e:
+            self._error('read', e)
+            return None
+        if row is not None and row.expires_at > time.time():
+            self.hits += 1
+            return row.reading
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        now = time.time()
+        row = CachedReading(key=key_digest(key), reading=value, created_at=now,
+                            expires_at=now + self.ttl)
+        try:
+            with session_factory(self.url)() as session, session.begin():
+                session.merge(row)
+        except SQLAlchemyError as e:
+            self._error('write', e)
+
+    def expire(self):
+        """Deletes expired rows and returns how many were removed."""
+        try:
+            with session_factory(self.url)() as session, session.begin():
+                result = session.execute(
+                    delete(CachedReading).where(CachedReading.expires_at <= time.time()))
+        except SQLAlchemyError as e:
+            self._error('expire', e)
+            return 0
+        self.expired += result.rowcount
+        return result.rowcount
+
+    def start_expiry(self, interval=READING_DB_EXPIRE_INTERVAL):
+        # One daemon thread per process; expiring twice is harmless
+        with self._lock:
+            if self._expiry_thread is not None:
+                return
+            self._expiry_thread = threading.Thread(target=self._expire_loop,
+                                                   args=(interval,),
+                                                   name='reading-expiry', daemon=True)
+        self._expiry_thread.start()
+
+    def _expire_loop(self, interval):
+        while True:
+            removed = self.expire()
+            if removed:
+                logging.info(f"Expired {removed} cached readings")
+            time.sleep(interval)
+
+    def _error(self, action, error):
+        self.errors += 1
+        logging.warning(f"Persistent reading cache {action} failed: {error}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': database_url(self.url).split(':', 1)[0].split('+', 1)[0],
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'expired': self.expired,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+persistent_cache = PersistentReadingCache()
+
+
+class ReadingArchive:
+    """
+    Stores finished readings so permalinks can serve them again without a
+    new generation. Rows older than `ttl` are deleted, at most once per
+    READING_DB_EXPIRE_INTERVAL, by the next save.
+    """
+
+    def __init__(self, url=DATABASE_URL, ttl=READING_ARCHIVE_TTL,
+                 reuse_ttl=READING_ARCHIVE_REUSE_TTL):
+        self.url = url
+        self.ttl = ttl
+        self.reuse_ttl = reuse_ttl
+        self.expired = 0
+        self._expired_at = 0.0
+
+    def save(self, question, card_ids, reading_type, reading, orientations=0,
+             digest=None):
+        """
+        Stores a reading and returns its id, or None if the write failed.
+        A row with the same `digest` stored within `reuse_ttl` is returned
+        instead of adding another.
+        """
+        now = time.time()
+        row = StoredReading(question=question,
+                            reading_type=reading_type,
+                            card_ids=','.join(map(str, card_ids)),
+                            orientations=orientations,
+                            reading=reading,
+                            digest=digest,
+                            created_at=now)
+        if now - self._expired_at > READING_DB_EXPIRE_INTERVAL:
+            self._expired_at = now
+            self.expire()
+        try:
+            with session_factory(self.url)() as session, session.begin():
+                if digest is not None:
+                    existing = session.scalar(
+                        select(StoredReading.id).where(
+                            StoredReading.digest == digest,
+                            StoredReading.created_at > now - self.reuse_ttl).limit(1))
+                    if existing is not None:
+                        return existing
+                session.add(row)
+                session.flush()
+                return row.id
+        except SQLAlchemyError as e:
+            logging.warning(f"Could not store reading: {e}")
+            return None
+
+    def expire(self):
+        """Deletes readings past the retention period; returns how many."""
+        if self.ttl <= 0:
+            return 0
+        try:
+            with session_factory(self.url)() as session, session.begin():
+                result = session.execute(delete(StoredReading).where(
+                    StoredReading.created_at <= time.time() - self.ttl))
+        except SQLAlchemyError as e:
+            logging.warning(f"Could not expire stored readings: {e}")
+            return 0
+        self.expired += result.rowcount
+        return result.rowcount
+
+    def load(self, reading_id):
+        try:
+            with session_factory(self.url)() as session:
+                return session.get(StoredReading, reading_id)
+        except SQLAlchemyError as e:
+            logging.warning(f"Could not load reading {reading_id}: {e}")
+            return None
+
+
+reading_archive = ReadingArchive()
+
+
+class ReadingJobStore:
+    """
+    Shared copy of background job state. Errors are logged and treated as
+    "not found", like the reading cache.
+    """
+
+    def __init__(self, url=DATABASE_URL):
+        self.url = url
+        self.errors = 0
+
+    def save(self, job_id, status, card_ids, text, error=None, permalink=None):
+        row = ReadingJobRecord(id=job_id, status=status,
+                               card_ids=','.join(map(str, card_ids)), text=text,
+                               error=error, permalink=permalink, updated_at=time.time())
+        try:
+            with session_factory(self.url)() as session, session.begin():
+                session.merge(row)
+        except SQLAlchemyError as e:
+            self._error('write', e)
+
+    def load(self, job_id):
+        try:
+            with session_factory(self.url)() as session:
+                return session.get(ReadingJobRecord, job_id)
+        except SQLAlchemyError as e:
+            self._error('read', e)
+            return None
+
+    def expire(self, ttl):
+        """Deletes jobs not updated for `ttl` seconds; returns how many."""
+        try:
+            with session_factory(self.url)() as session, session.begin():
+                result = session.execute(delete(ReadingJobRecord).where(
+                    ReadingJobRecord.updated_at <= time.time() - ttl))
+        except SQLAlchemyError as e:
+            self._error('expire', e)
+            return 0
+        return result.rowcount
+
+    def _error(self, action, error):
+        self.errors += 1
+        logging.warning(f"Reading job store {action} failed: {error}")
+
+
+job_store = ReadingJobStore()
@@ -8,16 +8,71 @@ class TarotApp {
         this.isSelectionComplete = false;
         // New property to hold the shuffled order of cards
         this.cardOrder = [];
+        // Card ids whose front face has already been loaded
+        this.loadedCards = new Set();
+        // Every card's data keyed by id, from the versioned deck manifest
+        this.deck = null;
 
         this.init();
     }
 
     init() {
+        this.loadDeck();
+
         // Shuffle the deck of cards before generating the grid
         this.shuffleDeck();
         this.bindEvents();
         this.setupReadingTypeSelection();
         this.generateCardGrid();
+
+        // ?r=<token> opens a shared reading instead of a new one
+        const sharedToken = new URLSearchParams(window.location.search).get('r');
+        if (sharedToken) {
+            this.loadSharedReading(sharedToken);
+        }
+    }
+
+    async loadSharedReading(token) {
+        // Stored readings come straight from the server's archive (and, on
+        // revisits, from the browser cache) without generating anything
+        try {
+            const response = await fetch(`/r/${encodeURIComponent(token)}`);
+            const data = await response.json();
+            if (!response.ok || !data.success) {
+                throw new Error(data.error || 'Reading not found');
+            }
+            document.getElementById('user-question').value = data.question;
+            document.getElementById('question-section').classList.add('d-none');
+            this.displayReading(data.reading, data.cards);
+        } catch (error) {
+            console.error('Error loading shared reading:', error);
+            this.setPermalink(null);
+        }
+    }
+
+    setPermalink(token) {
+        // Keep the address bar pointing at the current reading so reloads
+        // and shared links don't trigger a new generation
+        const url = new URL(window.location.href);
+        if (token) {
+            url.searchParams.set('r', token);
+        } else {
+            url.searchParams.delete('r');
+        }
+        window.history.replaceState(null, '', url);
+    }
+
+    async loadDeck() {
+        // One long-cached request gives us every card, so selecting cards
+        // never has to go back to the server
+        try {
+            const response = await fetch(document.body.dataset.deckUrl);
+            const data = await response.json();
+            this.deck = new Map(data.cards.map(card => [card.id, card]));
+            this.selectedCards.forEach(cardId => this.renderCardFront(this.deck.get(cardId)));
+        } catch (error) {
+            console.error('Error loading deck:', error);
+        }
     }
 
     // New method to shuffle the deck
@@ -241,8 +296,10 @@ class TarotApp {
             this.animateCardSelection(cardElement, this.selectedCards.length - 1);
         }, 100);
 
-        // Load card data and update front face
-        this.loadCardData(cardId);
+        // Reveal the card face straight from the local deck
+        if (this.deck) {
+            this.renderCardFront(this.deck.get(cardId));
+        }
     }
 
     animateCardSelection(cardElement, selectionIndex) {
@@ -288,40 +345,64 @@ class TarotApp {
         }
     }
 
-    async loadCardData(cardId) {
+    async loadCardsData(cardIds) {
+        // Fetch every card of the spread in one batch request
+        const pending = cardIds.filter(cardId => !this.loadedCards.has(cardId));
+        if (pending.length === 0) return;
+        pending.forEach(cardId => this.loadedCards.add(cardId));
+
         try {
-            const response = await fetch(`/get_card/${cardId}`);
-            const cardData = await response.json();
-
-            if (cardData && cardData.name) {
-                document.getElementById(`card-name-${cardId}`).textContent = cardData.name;
-
-                // Try to load actual card image
-                const imageElement = document.getElementById(`card-image-${cardId}`);
-                const imagePath = `/static/images/${cardData.image}`;
-
-                // Create img element to test if image exists
-                const img = new Image();
-                img.onload = () => {
-                    imageElement.innerHTML = `<img src="${imagePath}" alt="${cardData.name}">`;
-                };
-                img.onerror = () => {
-                    // Keep placeholder if image doesn't exist
-                    imageElement.innerHTML = `<div style="font-size: 1.5rem;">✦</div><div style="font-size: 0.6rem;">${cardData.name}</div>`;
-                };
-                img.src = imagePath;
+            const response = await fetch(`/cards?ids=${pending.join(',')}`);
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Failed to load cards');
             }
+            data.cards.forEach(cardData => this.renderCardFront(cardData));
         } catch (error) {
             console.error('Error loading card data:', error);
-            document.getElementById(`card-name-${cardId}`).textContent = 'Card ' + (cardId + 1);
+            pending.forEach(cardId => {
+                this.loadedCards.delete(cardId);
+                document.getElementById(`card-name-${cardId}`).textContent = 'Card ' + (cardId + 1);
+            });
         }
     }
 
+    renderCardFront(cardData) {
+        if (!cardData || !cardData.name) return;
+
+        const cardId = cardData.id;
+        document.getElementById(`card-name-${cardId}`).textContent = cardData.name;
+
+        // Try to load actual card image
+        const imageElement = document.getElementById(`card-image-${cardId}`);
+        imageElement.innerHTML = this.cardPictureMarkup(cardData);
+        imageElement.querySelector('img').onerror = () => {
+            // Keep placeholder if image doesn't exist
+            imageElement.innerHTML = `<div style="font-size: 1.5rem;">✦</div><div style="font-size: 0.6rem;">${cardData.name}</div>`;
+        };
+    }
+
+    cardPictureMarkup(card, imgAttributes = '') {
+        // Prefer the resized AVIF/WebP variants listed by the server; cards
+        // render at ~120px, so let the browser pick a width from srcset
+        const images = card.images || { src: `/static/images/${card.image}`, sources: [] };
+        const sources = images.sources.map(source =>
+            `<source type="${source.type}" srcset="${source.srcset}" sizes="120px">`
+        ).join('');
+        return `<picture>${sources}<img src="${images.src}" alt="${card.name}" ${imgAttributes}></picture>`;
+    }
+
     checkSelectionComplete() {
         const revealBtn = document.getElementById('reveal-reading-btn');
 
         if (this.selectedCards.length === this.requiredCards) {
             this.isSelectionComplete = true;
+
+            // Without the deck manifest, load the spread's card data in a
+            // single request instead
+            if (!this.deck) {
+                this.loadCardsData(this.selectedCards);
+            }
             revealBtn.classList.remove('d-none');
             revealBtn.classList.add('mystical-glow');
 
@@ -381,7 +462,8 @@ class TarotApp {
         document.getElementById('loading-overlay').classList.remove('d-none');
 
         try {
-            const response = await fetch('/get_reading', {
+            // Enqueue the reading; the server answers right away with a job id
+            const response = await fetch('/readings', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -393,13 +475,23 @@ class TarotApp {
                 })
             });
 
-            const data = await response.json();
+            const job = await response.json();
 
-            if (data.success) {
-                this.displayReading(data.reading, data.cards);
-            } else {
-                throw new Error(data.error || 'Failed to generate reading');
+            if (!job.success) {
+                throw new Error(job.error || 'Failed to generate reading');
+            }
+
+            // Swap the overlay for the spread while the reading is written
+            document.getElementById('loading-overlay').classList.add('d-none');
+            this.displayReading(null, job.cards);
+            let result = await this.pollReadingJob(job.status_url);
+            if (!result) {
+                // The poll reached an instance that doesn't know the job
+                // (autoscale without a shared database); generate it directly
+                result = await this.fetchReading(question);
+                this.renderReadingText(result.reading);
             }
+            this.setPermalink(result.permalink);
         } catch (error) {
             console.error('Error generating reading:', error);
             const msgBox = document.createElement('div');
@@ -413,6 +505,60 @@ class TarotApp {
         }
     }
 
+    async pollReadingJob(statusUrl) {
+        let offset = 0;
+        let readingText = '';
+
+        while (true) {
+            // Long-poll: the server holds the request until new text arrives
+            const response = await fetch(`${statusUrl}?since=${offset}&wait=15`);
+            if (response.status === 404) return null;
+            const data = await response.json();
+
+            if (!response.ok || data.status === 'error') {
+                throw new Error(data.error || 'Failed to generate reading');
+            }
+
+            if (data.text) {
+                readingText += data.text;
+                this.renderReadingText(readingText);
+            }
+            offset = data.offset;
+
+            if (data.done) return data;
+        }
+    }
+
+    async fetchReading(question) {
+        const response = await fetch('/get_reading', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                question: question,
+                selected_cards: this.selectedCards,
+                reading_type: this.readingType
+            })
+        });
+        const data = await response.json();
+        if (!data.success) {
+            throw new Error(data.error || 'Failed to generate reading');
+        }
+        return data;
+    }
+
+    renderReadingText(reading) {
+        const aiReading = document.getElementById('ai-reading');
+        let textDiv = aiReading.firstElementChild;
+        if (!textDiv) {
+            textDiv = document.createElement('div');
+            textDiv.style.whiteSpace = 'pre-line';
+            aiReading.appendChild(textDiv);
+        }
+        textDiv.textContent = reading;
+    }
+
     displayReading(reading, cards) {
         // Hide card selection and show reading
         document.getElementById('card-selection-section').classList.add('d-none');
@@ -490,18 +636,20 @@ class TarotApp {
             });
         }, cardElements.length * 200 + 500);
 
-        // Display AI reading after all cards flipped
-        setTimeout(() => {
-            document.getElementById('ai-reading').innerHTML = `<div style="white-space: pre-line;">${reading}</div>`;
-        }, cardElements.length * 1000);
+        // Display AI reading after all cards flipped; streamed readings
+        // (reading === null) are rendered as their tokens arrive instead
+        if (reading !== null) {
+            setTimeout(() => {
+                this.renderReadingText(reading);
+            }, cardElements.length * 1000);
+        }
     }
 
 
     getCardImageOrPlaceholder(card) {
-        // Try to get actual card image path
-        const imagePath = `/static/images/${card.image}`;
-        return `<img src="${imagePath}" alt="${card.name}" style="width: 100%; height: 100%; object-fit: cover; border-radius: 8px; position: absolute; top: 0; left: 0;" 
-                    onerror="this.style.display='none'; this.nextElementSibling.style.display='flex';">
+        // Try to get actual card image, falling back to the placeholder below
+        return `${this.cardPictureMarkup(card, `style="width: 100%; height: 100%; object-fit: cover; border-radius: 8px; position: absolute; top: 0; left: 0;" 
+                    onerror="this.style.display='none'; this.parentElement.nextElementSibling.style.display='flex';"`)}
                 <div style="display: none; width: 100%; height: 100%; align-items: center; justify-content: center; flex-direction: column; background: linear-gradient(145deg, #2D1B69, #1a0d4a); border-radius: 8px; position: absolute; top: 0; left: 0;">
                     <div style="font-size: 2rem; margin-bottom: 5px; color: #C9A96E;">✦</div>
                     <div style="font-size: 0.6rem; text-align: center; color: #C9A96E; padding: 5px;">${card.name}</div>
@@ -541,6 +689,8 @@ class TarotApp {
         this.readingType = '1-card';
         this.requiredCards = 1;
         this.isSelectionComplete = false;
+        this.loadedCards.clear();
+        this.setPermalink(null);
 
         // Shuffle the deck for a new reading
         this.shuffleDeck();
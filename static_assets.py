@@ -0,0 +1,195 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+
+from werkzeug.utils import safe_join
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# Written by `python build_static.py fingerprint`; without it files are
+# hashed lazily on first use
+ASSET_MANIFEST_PATH = os.path.join(STATIC_DIR, 'asset-manifest.json')
+FINGERPRINT_LENGTH = 12
+# name.<hash>.ext, e.g. css/style.3f2a9c1b7d4e.css
+FINGERPRINTED_NAME = re.compile(
+    r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<ext>\.[^./]+)$' % FINGERPRINT_LENGTH)
+
+# Text assets that `python build_static.py compress` writes .br/.gz
+# siblings for; encodings are listed in order of preference
+PRECOMPRESSED_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt')
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Written by `python build_static.py images`; paths are relative to STATIC_DIR
+IMAGE_VARIANTS_DIR = 'images/variants'
+IMAGE_MANIFEST_PATH = os.path.join(STATIC_DIR, IMAGE_VARIANTS_DIR, 'manifest.json')
+# Browsers without srcset support get the PNG variant closest to this width
+DEFAULT_IMAGE_WIDTH = 240
+# Order matters: <picture> sources are tried first to last
+IMAGE_FORMATS = ('avif', 'webp', 'png')
+IMAGE_MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'png': 'image/png'}
+
+
+def load_image_manifest(path=IMAGE_MANIFEST_PATH):
+    """Loads the resized image manifest, or {} if the build step hasn't run."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read image manifest {path}: {e}")
+        return {}
+
+
+def file_fingerprint(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:FINGERPRINT_LENGTH]
+
+
+class AssetFingerprints:
+    """
+    Maps static file names to content-hashed names (css/style.css ->
+    css/style.<hash>.css) and back. Hashes come from the asset manifest when
+    it is present and up to date, otherwise they are computed on first use;
+    either way a file whose size or mtime changed is re-hashed.
+    """
+
+    def __init__(self, static_dir=STATIC_DIR, manifest_path=ASSET_MANIFEST_PATH):
+        self.static_dir = static_dir
+        self._entries = self._load_manifest(manifest_path) if manifest_path else {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_manifest(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read asset manifest {path}: {e}")
+            return {}
+
+    def fingerprint(self, filename):
+        """Returns the content hash of a static file, or None if it doesn't exist."""
+        path = safe_join(self.static_dir, filename)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        entry = self._entries.get(filename)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry['hash']
+
+        entry = {'hash': file_fingerprint(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        with self._lock:
+            self._entries[filename] = entry
+        return entry['hash']
+
+    def url_path(self, filename):
+        """The fingerprinted name to put in URLs for `filename`."""
+        digest = self.fingerprint(filename)
+        if digest is None:
+            return filename
+        stem, ext = os.path.splitext(filename)
+        return f"{stem}.{digest}{ext}"
+
+    def resolve(self, requested):
+        """
+        Maps a requested static path back to the file on disk. Returns
+        (filename, immutable): immutable is True only when the hash in the
+        name matches the file's current content.
+        """
+        match = FINGERPRINTED_NAME.match(requested)
+        if not match:
+            return requested, False
+        original = match.group('stem') + match.group('ext')
+        digest = self.fingerprint(original)
+        if digest is None:
+            return requested, False
+        return original, digest == match.group('hash')
+
+    def manifest(self):
+        with self._lock:
+            return dict(self._entries)
+
+
+asset_fingerprints = AssetFingerprints()
+
+
+def precompressed_variant(filename, accept_encodings):
+    """
+    Picks a prebuilt .br/.gz sibling of `filename` that the client accepts.
+    Returns (sibling filename, content encoding), or None to serve the file
+    as is. Siblings older than the file itself are ignored.
+    """
+    if not filename.endswith(PRECOMPRESSED_EXTENSIONS):
+        return None
+    path = safe_join(STATIC_DIR, filename)
+    if path is None:
+        return None
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        if not accept_encodings[encoding]:
+            continue
+        try:
+            if os.stat(path + suffix).st_mtime_ns >= mtime:
+                return filename + suffix, encoding
+        except OSError:
+            continue
+    return None
+
+
+def static_url(filename):
+    return '/static/' + asset_fingerprints.url_path(filename)
+
+
+def image_sources(image, manifest):
+    """
+    Describes how the frontend should load `image` (a file name under
+    static/images): a fallback `src` plus, when resized variants exist, a
+    srcset per format for <picture>/<source> elements.
+    """
+    original = static_url('images/' + image)
+    entry = manifest.get(image)
+    if not entry:
+        return {'src': original, 'sources': []}
+
+    sources = []
+    fallback = original
+    for fmt in IMAGE_FORMATS:
+        variants = entry['variants'].get(fmt)
+        if not variants:
+            continue
+        srcset = ', '.join(f"{static_url(v['path'])} {v['width']}w" for v in variants)
+        sources.append({'type': IMAGE_MIME_TYPES[fmt], 'srcset': srcset})
+        if fmt == 'png':
+            closest = min(variants, key=lambda v: abs(v['width'] - DEFAULT_IMAGE_WIDTH))
+            fallback = static_url(closest['path'])
+
+    return {
+        'src': fallback,
+        'sources': sources,
+        'width': entry['width'],
+        'height': entry['height'],
+    }
+
+
+def build_image_sources(images, manifest=None):
+    """Precomputes image_sources() for every image name in `images`."""
+    if manifest is None:
+        manifest = load_image_manifest()
+    return {image: image_sources(image, manifest) for image in images}
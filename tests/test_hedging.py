@@ -0,0 +1,167 @@
+import time
+import asyncio
+
+import pytest
+
+import openai_service
+from openai_service import STUB_READING, Deadline, Hedger, StreamStatus, StubBackend
+
+
+def stub(label, latency, chunk_delay=0):
+    backend = StubBackend(latency=latency, chunk_delay=chunk_delay)
+    backend.label = label
+    return backend
+
+
+@pytest.fixture(autouse=True)
+def short_delays(monkeypatch):
+    # Hedge after 0.2 s until enough latencies have been recorded
+    monkeypatch.setattr(openai_service, "HEDGE_DEFAULT_DELAY", 0.2)
+    monkeypatch.setattr(openai_service, "HEDGE_MIN_DELAY", 0)
+
+
+def make_hedger(alternate, max_rate=1.0):
+    hedger = Hedger(backend_name="alternate", max_rate=max_rate)
+    hedger.alternate = lambda: alternate
+    return hedger
+
+
+def labelled(backend, max_tries, deadline):
+    # Which backend answered, so the winner is visible in the result
+    return backend.complete([], max_tries, deadline) and backend.label
+
+
+def failing(backend, max_tries, deadline):
+    backend.complete([], max_tries, deadline)
+    return None
+
+
+def test_primary_wins_without_hedging():
+    hedger = make_hedger(stub("alternate", 0.01))
+    assert hedger.run(labelled, stub("primary", 0.01), 2, Deadline(5)) == "primary"
+    stats = hedger.stats()
+    assert (stats["calls"], stats["hedged"], stats["primary_wins"]) == (1, 0, 1)
+    assert len(hedger._latencies) == 1
+
+
+def test_hedge_wins_when_primary_is_slow():
+    hedger = make_hedger(stub("alternate", 0.01))
+    started = time.monotonic()
+    assert hedger.run(labelled, stub("primary", 2), 2, Deadline(5)) == "alternate"
+    assert time.monotonic() - started < 1
+    stats = hedger.stats()
+    assert (stats["hedged"], stats["hedge_wins"], stats["primary_wins"]) == (1, 1, 0)
+
+
+def test_primary_still_wins_after_hedging():
+    hedger = make_hedger(stub("alternate", 2))
+    assert hedger.run(labelled, stub("primary", 0.4), 2, Deadline(5)) == "primary"
+    stats = hedger.stats()
+    assert (stats["hedged"], stats["primary_wins"], stats["hedge_wins"]) == (1, 1, 0)
+
+
+def test_rate_limit_waits_for_the_primary():
+    hedger = make_hedger(stub("alternate", 0.01), max_rate=0)
+    assert hedger.run(labelled, stub("primary", 0.4), 2, Deadline(5)) == "primary"
+    stats = hedger.stats()
+    assert (stats["hedged"], stats["rate_limited"], stats["primary_wins"]) == (0, 1, 1)
+
+
+def test_rate_limit_allows_a_share_of_calls():
+    hedger = make_hedger(stub("alternate", 0.01), max_rate=0.5)
+    for _ in range(4):
+        hedger.run(labelled, stub("primary", 0.3), 2, Deadline(5))
+    stats = hedger.stats()
+    assert (stats["hedged"], stats["rate_limited"]) == (2, 2)
+
+
+def test_both_fail():
+    hedger = make_hedger(stub("alternate", 0.01))
+    assert hedger.run(failing, stub("primary", 0.3), 2, Deadline(5)) is None
+    stats = hedger.stats()
+    assert (stats["hedged"], stats["failures"]) == (1, 1)
+    assert stats["primary_wins"] == stats["hedge_wins"] == 0
+    # Failed calls don't count towards the latency percentile
+    assert not hedger._latencies
+
+
+def test_no_hedge_once_the_deadline_is_spent():
+    def slow(backend, max_tries, deadline):
+        # Answers late, whatever is left of the deadline
+        time.sleep(0.4)
+        return backend.label
+
+    hedger = make_hedger(stub("alternate", 0.01))
+    assert hedger.run(slow, stub("primary", 0), 2, Deadline(0.6)) == "primary"
+    stats = hedger.stats()
+    assert (stats["hedged"], stats["primary_wins"]) == (0, 1)
+
+
+def test_async_hedge_wins_and_cancels_the_primary():
+    hedger = make_hedger(stub("alternate", 0.01))
+
+    async def call(backend, max_tries, deadline):
+        return await backend.complete_async([], max_tries, deadline) and backend.label
+
+    started = time.monotonic()
+    text = asyncio.run(hedger.run_async(call, stub("primary", 2), 2, Deadline(5)))
+    assert text == "alternate"
+    assert time.monotonic() - started < 1
+    assert hedger.stats()["hedge_wins"] == 1
+
+
+def open_stream(backend, max_tries, deadline, status):
+    return backend.stream([], max_tries, deadline, status=status)
+
+
+def read_stream(hedger, primary, deadline):
+    status = StreamStatus()
+    started = time.monotonic()
+    first_token = None
+    chunks = []
+    for chunk in hedger.run_stream(open_stream, primary, 1, deadline, status):
+        if first_token is None:
+            first_token = time.monotonic() - started
+        chunks.append(chunk)
+    return "".join(chunks), first_token, status
+
+
+def test_stream_primary_wins():
+    hedger = make_hedger(stub("alternate", 0.01))
+    text, _, status = read_stream(hedger, stub("primary", 0.01), Deadline(5))
+    assert text == STUB_READING
+    assert status.complete
+    stats = hedger.stats()
+    assert (stats["streams"], stats["hedged"], stats["primary_wins"]) == (1, 0, 1)
+
+
+def test_stream_hedge_wins_on_first_token():
+    hedger = make_hedger(stub("alternate", 0.01))
+    text, first_token, status = read_stream(hedger, stub("primary", 2), Deadline(5))
+    assert text == STUB_READING
+    assert first_token < 1
+    assert status.complete
+    stats = hedger.stats()
+    assert (stats["hedged"], stats["hedge_wins"]) == (1, 1)
+    assert len(hedger._first_token_latencies) == 1
+
+
+def test_stream_both_fail():
+    hedger = make_hedger(stub("alternate", 10))
+    # Neither stub can sleep through its latency within the deadline
+    text, first_token, status = read_stream(hedger, stub("primary", 10), Deadline(1))
+    assert text == "" and first_token is None
+    assert not status.complete
+    assert hedger.stats()["failures"] == 1
+
+
+def test_stream_reports_the_winners_status():
+    def broken_stream(backend, max_tries, deadline, status):
+        # Ends after one chunk without marking the status complete
+        yield backend.label
+
+    hedger = make_hedger(stub("alternate", 0.01))
+    status = StreamStatus()
+    text = "".join(hedger.run_stream(broken_stream, stub("primary", 0), 1, Deadline(5), status))
+    assert text == "primary"
+    assert not status.complete
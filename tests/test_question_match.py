@@ -0,0 +1,78 @@
+import pytest
+
+from question_match import (QuestionIndex, QuestionSignature, normalize_question,
+                            word_shingles, word_similarity)
+
+SPREAD = ((1, 2, 3), "3-card")
+
+
+def similarity(a, b):
+    return QuestionSignature(normalize_question(a)).similarity(
+        QuestionSignature(normalize_question(b)))
+
+
+def word(text):
+    return text, word_shingles(text)
+
+
+def matched(generated, asked, threshold=0.8):
+    index = QuestionIndex(threshold=threshold)
+    index.add((normalize_question(generated),) + SPREAD)
+    return index.match((normalize_question(asked),) + SPREAD)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Should I date Chris?", "Should I date Christa?"),
+    ("Will Dan call me?", "Will Dana call me?"),
+    ("Will Paul come back?", "Will Paula come back?"),
+    ("Is Ann the one?", "Is Anne the one?"),
+    ("Will I be fine?", "Will I be fined?"),
+    ("Will I win?", "Will I wine?"),
+    ("Will Sarah call me?", "Will Emma call me?"),
+    ("Should I move to Seattle?", "Should I move to Boston?"),
+    ("Will he leave me?", "Will he leave?"),
+    ("Will I get the job?", "Will I not get the job?"),
+])
+def test_different_questions_do_not_match(a, b):
+    assert similarity(a, b) < 0.8
+    assert matched(a, b) is None
+    assert matched(b, a) is None
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Will I get the job?", "Will I get the jobs?"),
+    ("Will my matches go well?", "Will my match go well?"),
+    ("Is my relationship going to last?", "Is my realtionship going to last?"),
+])
+def test_typos_and_plurals_match(a, b):
+    assert matched(a, b) == (normalize_question(a),) + SPREAD
+
+
+def test_normalized_duplicates_share_a_key():
+    assert normalize_question("Will I get the job?") == normalize_question("will i get this job??")
+
+
+@pytest.mark.parametrize("a, b, expected", [
+    ("job", "jobs", 1.0),
+    ("match", "matches", 1.0),
+    ("jam", "james", 0.0),
+    ("paul", "paula", 0.0),
+    ("win", "wine", 0.0),
+    ("us", "use", 0.0),
+])
+def test_word_similarity_of_extensions(a, b, expected):
+    assert word_similarity(word(a), word(b)) == expected
+    assert word_similarity(word(b), word(a)) == expected
+
+
+def test_threshold_is_strict():
+    # One plural out of one word scores exactly 1.0, which a threshold of 1 disables
+    assert matched("Jobs?", "Job?", threshold=1.0) is None
+    assert matched("Jobs?", "Job?", threshold=0.99) is not None
+
+
+def test_match_only_within_the_same_spread():
+    index = QuestionIndex(threshold=0.8)
+    index.add(("get job",) + SPREAD)
+    assert index.match(("get jobs", (1, 2, 4), "3-card")) is None
+    assert index.match(("get jobs",) + SPREAD) == ("get job",) + SPREAD